@@ -1,29 +1,89 @@
 import asyncio
 import json
 import random
+import msgspec
+import numpy as np
 import redis.asyncio as redis
-from datetime import datetime
+from redis.utils import HIREDIS_AVAILABLE
+from time import time_ns
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class Tick(msgspec.Struct, tag_field='type', tag='tick', rename='camel'):
+    """Market data tick published on the market data channel"""
+    symbol: str
+    last_trade_price: float
+    last_trade_quantity: int
+    bid_price: float
+    bid_quantity: int
+    ask_price: float
+    ask_quantity: int
+    total_volume: int
+    timestamp: int
+
+class Trade(msgspec.Struct, tag_field='type', tag='trade', rename='camel'):
+    """Simulated trade published on the trade channel"""
+    trade_id: int
+    symbol: str
+    price: float
+    quantity: int
+    timestamp: int
+
+class Snapshot(msgspec.Struct, rename='camel'):
+    """Latest market snapshot cached under orderbook:<symbol>"""
+    symbol: str
+    last_trade_price: float
+    bid_price: float
+    bid_quantity: int
+    ask_price: float
+    ask_quantity: int
+    total_volume: int
+    timestamp: int
+
+# Payloads stay JSON on the wire (the WebSocket server, API server and trading
+# engine all read them as JSON); msgspec encodes the structs directly to bytes
+_enc = msgspec.json.Encoder()
+
+# Pre-bound RNG methods for the per-symbol hot loop
+_rand = random.Random()
+_uniform = _rand.uniform
+_randint = _rand.randint
+_random = _rand.random
+
 class MarketDataGenerator:
     def __init__(self, config):
         self.config = config
         self.redis_client = None
         self.symbols = config.get('symbols', ['AAPL', 'GOOGL', 'MSFT', 'AMZN', 'TSLA'])
         
-        # Initialize prices for each symbol
-        self.prices = {
-            symbol: random.uniform(50.0, 500.0) for symbol in self.symbols
-        }
+        # Initialize prices for each symbol; the random walk runs on the
+        # array and the dict mirrors it for tick generation and logging
+        self._rng = np.random.default_rng()
+        self._prices = self._rng.uniform(50.0, 500.0, size=len(self.symbols))
+        self.prices = dict(zip(self.symbols, self._prices.tolist()))
+        
+        # Gaussian deltas are drawn in blocks of cycles and consumed one row per cycle
+        self._draw_block = 1024
+        self._draw_buf = None
+        self._draw_idx = 0
+        
+        # Redis snapshot key for each symbol, built once
+        self._snapshot_keys = {symbol: f"orderbook:{symbol}" for symbol in self.symbols}
         
         # Price volatility (standard deviation as percentage)
         self.volatility = config.get('volatility', 0.02)
         
         # Update interval in seconds
         self.update_interval = config.get('updateInterval', 1.0)
+        
+        # Log the price summary about once a second rather than every cycle
+        self._log_every = max(1, int(1.0 / self.update_interval))
+        self._cycle = 0
+        
+        # Background pipeline flush still in flight, if any
+        self._flush_task = None
     
     async def connect_redis(self):
         """Connect to Redis"""
@@ -33,108 +93,145 @@ class MarketDataGenerator:
             password=self.config['redis'].get('password', None),
             decode_responses=True
         )
-        logger.info("Connected to Redis")
+        # redis-py picks the C reply parser automatically when hiredis is installed
+        parser = "hiredis" if HIREDIS_AVAILABLE else "pure-Python"
+        logger.info(f"Connected to Redis ({parser} reply parser)")
     
-    def generate_price_movement(self, current_price):
-        """Generate realistic price movement using random walk"""
-        # Random percentage change
-        change_pct = random.gauss(0, self.volatility)
-        
-        # Apply change
-        new_price = current_price * (1 + change_pct)
-        
-        # Ensure price stays positive and reasonable
-        new_price = max(1.0, new_price)
-        new_price = min(10000.0, new_price)
+    def _next_deltas(self):
+        """Return this cycle's percentage changes, refilling the block when exhausted"""
+        if self._draw_buf is None or self._draw_idx == self._draw_block:
+            self._draw_buf = self._rng.normal(
+                0.0, self.volatility, size=(self._draw_block, len(self.symbols))
+            )
+            self._draw_idx = 0
         
-        return round(new_price, 2)
+        deltas = self._draw_buf[self._draw_idx]
+        self._draw_idx += 1
+        return deltas
     
-    def generate_market_tick(self, symbol, price):
-        """Generate a market data tick"""
-        # Generate bid/ask spread (0.1% to 0.5% of price)
-        spread = price * random.uniform(0.001, 0.005)
-        
-        bid_price = round(price - spread / 2, 2)
-        ask_price = round(price + spread / 2, 2)
-        
-        # Generate random volumes
-        bid_quantity = random.randint(100, 10000)
-        ask_quantity = random.randint(100, 10000)
-        last_quantity = random.randint(10, 1000)
-        total_volume = random.randint(100000, 1000000)
-        
-        return {
-            'type': 'tick',
-            'symbol': symbol,
-            'lastTradePrice': price,
-            'lastTradeQuantity': last_quantity,
-            'bidPrice': bid_price,
-            'bidQuantity': bid_quantity,
-            'askPrice': ask_price,
-            'askQuantity': ask_quantity,
-            'totalVolume': total_volume,
-            'timestamp': int(datetime.utcnow().timestamp() * 1000)
-        }
+    def _on_flush_done(self, flush):
+        """Report a failed background flush"""
+        if not flush.cancelled() and flush.exception() is not None:
+            logger.error(f"Error publishing market data: {flush.exception()}")
     
-    def generate_trade(self, symbol, price):
+    def generate_trade(self, symbol, price, timestamp):
         """Generate a simulated trade"""
-        quantity = random.randint(10, 1000)
+        quantity = _randint(10, 1000)
         
-        return {
-            'type': 'trade',
-            'tradeId': random.randint(1000000, 9999999),
-            'symbol': symbol,
-            'price': price,
-            'quantity': quantity,
-            'timestamp': int(datetime.utcnow().timestamp() * 1000)
-        }
+        return Trade(
+            trade_id=_randint(1000000, 9999999),
+            symbol=symbol,
+            price=price,
+            quantity=quantity,
+            timestamp=timestamp
+        )
     
     async def publish_market_data(self):
         """Continuously generate and publish market data"""
         channel = self.config['channels']['marketData']
         trade_channel = self.config['channels']['trade']
+        snapshot_keys = self._snapshot_keys
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
         
         while True:
             try:
-                for symbol in self.symbols:
-                    # Update price
-                    current_price = self.prices[symbol]
-                    new_price = self.generate_price_movement(current_price)
+                # Advance every symbol's random walk in one vectorized step,
+                # keeping prices positive and reasonable
+                deltas = self._next_deltas()
+                self._prices = np.clip(self._prices * (1.0 + deltas), 1.0, 10000.0).round(2)
+                
+                # One timestamp per cycle, shared by every tick, trade and snapshot
+                ts = time_ns() // 1_000_000
+                
+                ticks = []
+                snapshots = []
+                trades = []
+                for symbol, new_price in zip(self.symbols, self._prices.tolist()):
                     self.prices[symbol] = new_price
                     
-                    # Generate and publish market tick
-                    tick = self.generate_market_tick(symbol, new_price)
-                    await self.redis_client.publish(channel, json.dumps(tick))
+                    # Generate bid/ask spread (0.1% to 0.5% of price)
+                    spread = new_price * _uniform(0.001, 0.005)
+                    
+                    # Generate market tick with random volumes
+                    tick = Tick(
+                        symbol=symbol,
+                        last_trade_price=new_price,
+                        last_trade_quantity=_randint(10, 1000),
+                        bid_price=round(new_price - spread / 2, 2),
+                        bid_quantity=_randint(100, 10000),
+                        ask_price=round(new_price + spread / 2, 2),
+                        ask_quantity=_randint(100, 10000),
+                        total_volume=_randint(100000, 1000000),
+                        timestamp=ts
+                    )
+                    ticks.append(tick)
+                    snapshots.append(Snapshot(
+                        symbol=symbol,
+                        last_trade_price=new_price,
+                        bid_price=tick.bid_price,
+                        bid_quantity=tick.bid_quantity,
+                        ask_price=tick.ask_price,
+                        ask_quantity=tick.ask_quantity,
+                        total_volume=tick.total_volume,
+                        timestamp=ts
+                    ))
                     
                     # Occasionally generate a trade (10% chance per update)
-                    if random.random() < 0.1:
-                        trade = self.generate_trade(symbol, new_price)
-                        await self.redis_client.publish(trade_channel, json.dumps(trade))
+                    if _random() < 0.1:
+                        trades.append(self.generate_trade(symbol, new_price, ts))
+                
+                # Encode the whole cycle in one batch; msgspec is fast enough that
+                # shipping the structs to a worker process would cost more than it saves
+                payloads = [_enc.encode(message) for message in ticks + snapshots + trades]
+                
+                # Queue every command for this cycle and flush them in a single round-trip
+                pipe = self.redis_client.pipeline(transaction=False)
+                publish = pipe.publish
+                set_snapshot = pipe.set
+                
+                # Payloads are laid out as ticks, then snapshots, then trades
+                count = len(ticks)
+                for symbol, payload, snapshot_payload in zip(self.symbols, payloads, payloads[count:]):
+                    publish(channel, payload)
                     
                     # Cache current snapshot in Redis
-                    snapshot_key = f"orderbook:{symbol}"
-                    snapshot = {
-                        'symbol': symbol,
-                        'lastTradePrice': new_price,
-                        'bidPrice': tick['bidPrice'],
-                        'bidQuantity': tick['bidQuantity'],
-                        'askPrice': tick['askPrice'],
-                        'askQuantity': tick['askQuantity'],
-                        'totalVolume': tick['totalVolume'],
-                        'timestamp': tick['timestamp']
-                    }
-                    await self.redis_client.set(snapshot_key, json.dumps(snapshot), ex=60)
+                    set_snapshot(snapshot_keys[symbol], snapshot_payload, ex=60)
+                
+                for payload in payloads[2 * count:]:
+                    publish(trade_channel, payload)
+                
+                # Only one flush is kept in flight: if Redis is still working
+                # through the previous cycle, wait for it rather than open
+                # another connection that could also land out of order
+                if self._flush_task is not None and not self._flush_task.done():
+                    await asyncio.wait((self._flush_task,))
+                
+                # Market data needs no acknowledgement, so the flush runs in the
+                # background instead of holding up the cycle for the round-trip
+                self._flush_task = asyncio.create_task(pipe.execute())
+                self._flush_task.add_done_callback(self._on_flush_done)
                 
                 # Log current prices
-                price_str = ", ".join([f"{sym}: ${price:.2f}" for sym, price in self.prices.items()])
-                logger.info(f"Market Update - {price_str}")
+                self._cycle += 1
+                if self._cycle % self._log_every == 0 and logger.isEnabledFor(logging.INFO):
+                    price_str = ", ".join([f"{sym}: ${price:.2f}" for sym, price in self.prices.items()])
+                    logger.info("Market Update - %s", price_str)
                 
-                # Wait before next update
-                await asyncio.sleep(self.update_interval)
+                # Wait until the next deadline so time spent publishing doesn't
+                # accumulate as drift; if we fell behind, skip the missed ticks
+                next_tick += self.update_interval
+                delay = next_tick - loop.time()
+                if delay < 0:
+                    logger.warning(f"Market data cycle lagging by {-delay:.3f}s")
+                    next_tick = loop.time()
+                    delay = 0
+                await asyncio.sleep(delay)
                 
             except Exception as e:
                 logger.error(f"Error generating market data: {e}")
                 await asyncio.sleep(1)
+                next_tick = loop.time()
     
     async def start(self):
         """Start the market data generator"""
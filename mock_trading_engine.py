@@ -4,29 +4,65 @@ import socketserver
 import json
 import time
 import threading
+import heapq
+import itertools
+from collections import defaultdict
 from urllib.parse import urlparse
 import sys
 
+# orjson is used at the HTTP boundary when available; the mock still runs on
+# a bare interpreter with the stdlib encoder
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
 # In-memory data structures
 # Symbol -> {'bids': [], 'asks': []}
-# Bids: Descending Price (High to Low)
-# Asks: Ascending Price (Low to High)
+# Bids: max-heap of (-price, orderId, order) (High to Low, then FIFO)
+# Asks: min-heap of (price, orderId, order) (Low to High, then FIFO)
 # Orders: list of dicts or objects
+# Prices are held as integer ticks (cents) and only converted back to
+# floats at the edges (to_dict, trades, quotes)
+PRICE_SCALE = 100
+
+def to_ticks(price):
+    # Off-tick prices are rejected rather than rounded, since rounding could
+    # move a limit to a worse price for the client
+    ticks = float(price) * PRICE_SCALE
+    rounded = round(ticks)
+    if abs(ticks - rounded) > 1e-6:
+        raise ValueError(f"Price must be a multiple of {1 / PRICE_SCALE}")
+    return int(rounded)
+
 order_books = {}
 orders = {} # orderId -> order
-next_order_id = 1
-lock = threading.Lock()
+# count.__next__ runs in C without releasing the GIL, so ids are allocated
+# atomically without a lock
+next_order_id = itertools.count(1).__next__
+
+# One lock per symbol so orders on different books never serialize each other
+symbol_locks = defaultdict(threading.Lock)
+symbol_locks_meta = threading.Lock()
+
+def get_symbol_lock(symbol):
+    with symbol_locks_meta:
+        return symbol_locks[symbol]
 
 class Order:
     def __init__(self, user_id, symbol, side, type, price, quantity, tif):
-        global next_order_id
-        self.id = next_order_id
-        next_order_id += 1
+        self.price = to_ticks(price) if price is not None else 0
+        self.id = next_order_id()
         self.user_id = user_id
         self.symbol = symbol
         self.side = side # "BUY" or "SELL"
         self.type = type # "LIMIT" or "MARKET"
-        self.price = float(price) if price is not None else 0.0
         self.initial_quantity = int(quantity)
         self.remaining_quantity = int(quantity)
         self.tif = tif # "GFD", "IOC", "FOK"
@@ -40,7 +76,7 @@ class Order:
             "symbol": self.symbol,
             "side": self.side,
             "type": self.type,
-            "price": self.price,
+            "price": self.price / PRICE_SCALE,
             "quantity": self.initial_quantity,
             "remainingQuantity": self.remaining_quantity,
             "timeInForce": self.tif,
@@ -57,80 +93,78 @@ def match_order(order):
     # Matching logic
     trades = []
     
+    # Hoist the taker's fields into locals so the matching loops below only
+    # touch the resting order at the head of the book on each iteration.
+    # MARKET orders cross at any price.
+    remaining = order.remaining_quantity
+    if order.type == "LIMIT":
+        limit_price = order.price
+    else:
+        limit_price = sys.maxsize if order.side == "BUY" else 0
+
     if order.side == "BUY":
-        # Match against Asks (Low to High)
+        # Match against Asks (Low to High) while the best ask's heap key crosses
         asks = book['asks']
-        i = 0
-        while i < len(asks) and order.remaining_quantity > 0:
-            ask = asks[i]
+        while asks and remaining > 0 and asks[0][0] <= limit_price:
+            ask_price, _, ask = asks[0]
             
-            # Check price for LIMIT orders
-            if order.type == "LIMIT" and ask.price > order.price:
-                break
-                
             # Match
-            match_qty = min(order.remaining_quantity, ask.remaining_quantity)
-            price = ask.price # Trade at maker price
+            ask_remaining = ask.remaining_quantity
+            match_qty = remaining if remaining < ask_remaining else ask_remaining
             
             trades.append({
                 "symbol": order.symbol,
-                "price": price,
+                "price": ask_price / PRICE_SCALE, # Trade at maker price
                 "quantity": match_qty,
                 "buyer": order.id,
                 "seller": ask.id
             })
             
-            order.remaining_quantity -= match_qty
-            ask.remaining_quantity -= match_qty
+            remaining -= match_qty
+            ask_remaining -= match_qty
+            ask.remaining_quantity = ask_remaining
             
-            if ask.remaining_quantity == 0:
+            if ask_remaining == 0:
                 ask.status = "FILLED"
-                asks.pop(i) # Remove filled ask
+                heapq.heappop(asks) # Remove filled ask
             else:
+                # Ask not fully filled means the order is, so stop matching
                 ask.status = "PARTIALLY_FILLED"
-                i += 1 # Should verify if we pop or increment
-                # If we pop, we don't increment i
-                # Ah, if we pop, the next item slides into i. So we only increment if we DON'T pop.
-                # Re-logic:
-                # If popped, do nothing (i points to next).
-                # If not popped, that means ask wasn't fully filled (so order must be filled), leads to break.
-                # Actually if ask is not filled, order MUST be filled (min logic).
-                # So we can break.
                 break
 
     else: # SELL
-        # Match against Bids (High to Low)
+        # Match against Bids (High to Low); keys are negated prices, so the
+        # best bid crosses while -key >= limit_price
         bids = book['bids']
-        i = 0
-        while i < len(bids) and order.remaining_quantity > 0:
-            bid = bids[i]
-            
-            # Check price for LIMIT orders
-            if order.type == "LIMIT" and bid.price < order.price:
-                break
+        while bids and remaining > 0 and bids[0][0] <= -limit_price:
+            neg_bid_price, _, bid = bids[0]
+            bid_price = -neg_bid_price
             
             # Match
-            match_qty = min(order.remaining_quantity, bid.remaining_quantity)
-            price = bid.price # Trade at maker price
+            bid_remaining = bid.remaining_quantity
+            match_qty = remaining if remaining < bid_remaining else bid_remaining
             
             trades.append({
                 "symbol": order.symbol,
-                "price": price,
+                "price": bid_price / PRICE_SCALE, # Trade at maker price
                 "quantity": match_qty,
                 "buyer": bid.id,
                 "seller": order.id
             })
             
-            order.remaining_quantity -= match_qty
-            bid.remaining_quantity -= match_qty
+            remaining -= match_qty
+            bid_remaining -= match_qty
+            bid.remaining_quantity = bid_remaining
             
-            if bid.remaining_quantity == 0:
+            if bid_remaining == 0:
                 bid.status = "FILLED"
-                bids.pop(i)
+                heapq.heappop(bids)
             else:
                 bid.status = "PARTIALLY_FILLED"
                 break
 
+    order.remaining_quantity = remaining
+
     # Post-match processing
     if order.remaining_quantity > 0:
         if order.tif == "IOC":
@@ -139,14 +173,11 @@ def match_order(order):
         else:
             # Add to book
             order.status = "PARTIALLY_FILLED" if order.remaining_quantity < order.initial_quantity else "NEW"
+            # Order id breaks price ties so equal prices keep arrival order
             if order.side == "BUY":
-                book['bids'].append(order)
-                # Sort Bids: High to Low
-                book['bids'].sort(key=lambda x: x.price, reverse=True)
+                heapq.heappush(book['bids'], (-order.price, order.id, order))
             else:
-                book['asks'].append(order)
-                # Sort Asks: Low to High
-                book['asks'].sort(key=lambda x: x.price)
+                heapq.heappush(book['asks'], (order.price, order.id, order))
 
     else:
         order.status = "FILLED"
@@ -154,36 +185,49 @@ def match_order(order):
     return trades
 
 class TradingHandler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive between requests; every response carries a
+    # Content-Length so clients know where each body ends
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, payload):
+        body = json_dumps(payload)
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET(self):
         parsed = urlparse(self.path)
         
         if parsed.path == "/health":
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "healthy", "redis": "connected (mock)"}).encode())
+            self.send_json(200, {"status": "healthy", "redis": "connected (mock)"})
             return
             
         if parsed.path.startswith("/market/quote/"):
             symbol = parsed.path.split("/")[-1]
-            with lock:
-                book = order_books.get(symbol, {'bids': [], 'asks': []})
-                best_bid = book['bids'][0] if book['bids'] else None
-                best_ask = book['asks'][0] if book['asks'] else None
-                
-                quote = {
-                    "symbol": symbol,
-                    "lastTradePrice": 150.0, # Dummy
-                    "bidPrice": best_bid.price if best_bid else 0.0,
-                    "bidQuantity": best_bid.remaining_quantity if best_bid else 0,
-                    "askPrice": best_ask.price if best_ask else 0.0,
-                    "askQuantity": best_ask.remaining_quantity if best_ask else 0
-                }
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": True, "data": quote}).encode())
+            
+            # Only symbols with a book get a lock; an unknown symbol quotes
+            # empty without creating one
+            book = order_books.get(symbol)
+            best_bid = best_ask = None
+            if book is not None:
+                with get_symbol_lock(symbol):
+                    best_bid = book['bids'][0][2] if book['bids'] else None
+                    best_ask = book['asks'][0][2] if book['asks'] else None
+            
+            quote = {
+                "symbol": symbol,
+                "lastTradePrice": 150.0, # Dummy
+                "bidPrice": best_bid.price / PRICE_SCALE if best_bid else 0.0,
+                "bidQuantity": best_bid.remaining_quantity if best_bid else 0,
+                "askPrice": best_ask.price / PRICE_SCALE if best_ask else 0.0,
+                "askQuantity": best_ask.remaining_quantity if best_ask else 0
+            }
+            
+            # Socket writes happen outside the lock so a slow client
+            # cannot stall matching for everyone else
+            self.send_json(200, {"success": True, "data": quote})
             return
 
         self.send_error(404)
@@ -194,7 +238,7 @@ class TradingHandler(http.server.BaseHTTPRequestHandler):
         
         if self.path == "/order/place":
             try:
-                data = json.loads(post_data)
+                data = json_loads(post_data)
                 
                 # Validation
                 required = ["userId", "symbol", "side", "type", "quantity"]
@@ -206,7 +250,7 @@ class TradingHandler(http.server.BaseHTTPRequestHandler):
                 if data["type"] == "LIMIT" and price is None:
                      raise ValueError("Price required for LIMIT order")
                      
-                with lock:
+                with get_symbol_lock(data["symbol"]):
                     order = Order(
                         data["userId"],
                         data["symbol"],
@@ -220,29 +264,28 @@ class TradingHandler(http.server.BaseHTTPRequestHandler):
                     orders[order.id] = order
                     match_order(order)
                     
-                    # Log for debugging
-                    print(f"Order processed: {order.id} {order.side} {order.symbol} {order.remaining_quantity}/{order.initial_quantity} left")
+                    # Capture the post-match state while still consistent;
+                    # logging and the response are built outside the lock
+                    result = order.to_dict()
+                
+                # Log for debugging
+                print(f"Order processed: {result['orderId']} {result['side']} {result['symbol']} {result['remainingQuantity']}/{result['quantity']} left")
                 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": True, "data": order.to_dict()}).encode())
+                self.send_json(200, {"success": True, "data": result})
                 
             except Exception as e:
-                self.send_response(400) # Changed to 200 with error? No, typically 400 for bad request
+                # Changed to 200 with error? No, typically 400 for bad request
                 # But test_system check looks for .json() even on error sometimes?
                 # test_system says: if response.status_code == 400 or not data.get('success'): ... print_success
                 # So 400 is fine.
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode())
+                self.send_json(400, {"success": False, "error": str(e)})
             return
             
         self.send_error(404)
 
 def run_server():
     server_address = ('', 8080)
-    httpd = http.server.HTTPServer(server_address, TradingHandler)
+    httpd = http.server.ThreadingHTTPServer(server_address, TradingHandler)
     print("Mock Trading Engine running on port 8080...")
     httpd.serve_forever()
 
@@ -11,6 +11,10 @@ import sys
 
 API_URL = "http://localhost:8080"
 
+# Reuse one keep-alive connection across tests instead of a new TCP
+# handshake per request
+SESSION = requests.Session()
+
 def print_header(text):
     print("\n" + "="*60)
     print(f"  {text}")
@@ -26,7 +30,7 @@ def test_health_check():
     """Test API server health"""
     print_header("Test 1: Health Check")
     try:
-        response = requests.get(f"{API_URL}/health", timeout=5)
+        response = SESSION.get(f"{API_URL}/health", timeout=5)
         data = response.json()
         
         if response.status_code == 200 and data.get('status') == 'healthy':
@@ -55,7 +59,7 @@ def test_place_limit_order():
     }
     
     try:
-        response = requests.post(f"{API_URL}/order/place", json=order, timeout=5)
+        response = SESSION.post(f"{API_URL}/order/place", json=order, timeout=5)
         data = response.json()
         
         if response.status_code == 200 and data.get('success'):
@@ -82,7 +86,7 @@ def test_place_market_order():
     }
     
     try:
-        response = requests.post(f"{API_URL}/order/place", json=order, timeout=5)
+        response = SESSION.post(f"{API_URL}/order/place", json=order, timeout=5)
         data = response.json()
         
         if response.status_code == 200 and data.get('success'):
@@ -124,7 +128,7 @@ def test_matching_orders():
     
     try:
         # Place buy order
-        response1 = requests.post(f"{API_URL}/order/place", json=buy_order, timeout=5)
+        response1 = SESSION.post(f"{API_URL}/order/place", json=buy_order, timeout=5)
         data1 = response1.json()
         
         if not (response1.status_code == 200 and data1.get('success')):
@@ -135,7 +139,7 @@ def test_matching_orders():
         time.sleep(0.5)  # Brief delay
         
         # Place sell order
-        response2 = requests.post(f"{API_URL}/order/place", json=sell_order, timeout=5)
+        response2 = SESSION.post(f"{API_URL}/order/place", json=sell_order, timeout=5)
         data2 = response2.json()
         
         if not (response2.status_code == 200 and data2.get('success')):
@@ -155,7 +159,7 @@ def test_get_market_quote():
     print_header("Test 5: Get Market Quote")
     
     try:
-        response = requests.get(f"{API_URL}/market/quote/AAPL", timeout=5)
+        response = SESSION.get(f"{API_URL}/market/quote/AAPL", timeout=5)
         data = response.json()
         
         if response.status_code == 200 and data.get('success'):
@@ -188,7 +192,7 @@ def test_ioc_order():
     }
     
     try:
-        response = requests.post(f"{API_URL}/order/place", json=order, timeout=5)
+        response = SESSION.post(f"{API_URL}/order/place", json=order, timeout=5)
         data = response.json()
         
         if response.status_code == 200 and data.get('success'):
@@ -216,7 +220,7 @@ def test_validation():
     }
     
     try:
-        response = requests.post(f"{API_URL}/order/place", json=invalid_order, timeout=5)
+        response = SESSION.post(f"{API_URL}/order/place", json=invalid_order, timeout=5)
         data = response.json()
         
         if response.status_code == 400 or not data.get('success'):
@@ -1,25 +1,89 @@
 import asyncio
 import websockets
+from websockets import broadcast as ws_broadcast
 import json
+import orjson
+import socket
 import redis.asyncio as redis
-from typing import Set
+from typing import List, Set
+from weakref import WeakSet
+
+# uvloop is not available on Windows; fall back to the stock event loop there
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 import logging
-from datetime import datetime
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Unsent bytes a client may have buffered before it is dropped as too slow
+CLIENT_WRITE_BUFFER_LIMIT = 1 << 20
+
+# Kernel socket buffer sizes requested for each client. Memory cost is roughly
+# CLIENT_SNDBUF x connected clients; the kernel silently clamps the request to
+# net.core.wmem_max / rmem_max
+CLIENT_SNDBUF = 1 << 20
+CLIENT_RCVBUF = 1 << 18
+
+# Fixed-shape control responses; only the timestamp is filled in per send
+PONG_TEMPLATE = '{"type":"pong","timestamp":%d}'
+INVALID_JSON_TEMPLATE = '{"type":"error","message":"Invalid JSON","timestamp":%d}'
+
+def _now_ms() -> int:
+    """Current Unix time in milliseconds"""
+    return time.time_ns() // 1_000_000
+
 class WebSocketServer:
     def __init__(self, config):
         self.config = config
         self.redis_client = None
-        self.pubsub = None
+        self.pubsubs = []
+        
+        # Connected clients for each channel; weak so a connection drops out of
+        # every set on its own once it is gone
+        self.market_data_clients: WeakSet[websockets.WebSocketServerProtocol] = WeakSet()
+        self.order_update_clients: WeakSet[websockets.WebSocketServerProtocol] = WeakSet()
+        self.trade_clients: WeakSet[websockets.WebSocketServerProtocol] = WeakSet()
+        self.all_clients: WeakSet[websockets.WebSocketServerProtocol] = WeakSet()
+        
+        # Connection path -> client set and the name used when logging it
+        self._path_sets = {
+            '/ws/marketdata': (self.market_data_clients, 'market data'),
+            '/ws/orderupdates': (self.order_update_clients, 'order updates'),
+            '/ws/trades': (self.trade_clients, 'trades'),
+            '/ws/all': (self.all_clients, 'all channels'),
+        }
+        
+        # Subscribe/unsubscribe channel name -> client set
+        self._channel_sets = {
+            'marketdata': self.market_data_clients,
+            'orderupdates': self.order_update_clients,
+            'trades': self.trade_clients,
+        }
+        
+        # Prebuilt subscription acks per status and known channel; only the
+        # timestamp is filled in per send
+        self._sub_templates = {
+            status: {
+                channel: '{"type":"subscription","status":"%s","channel":"%s","timestamp":%%d}' % (status, channel)
+                for channel in self._channel_sets
+            }
+            for status in ('success', 'unsubscribed')
+        }
+        
+        # Close handshakes in flight for clients dropped as too slow
+        self._closing_tasks: Set[asyncio.Task] = set()
         
-        # Connected clients for each channel
-        self.market_data_clients: Set[websockets.WebSocketServerProtocol] = set()
-        self.order_update_clients: Set[websockets.WebSocketServerProtocol] = set()
-        self.trade_clients: Set[websockets.WebSocketServerProtocol] = set()
-        self.all_clients: Set[websockets.WebSocketServerProtocol] = set()
+        # Encoded messages waiting for the next batch flush, per client set
+        self._batch_window = self.config['server'].get('batchWindowMs', 2) / 1000
+        self._pending_market: List[str] = []
+        self._pending_order: List[str] = []
+        self._pending_trade: List[str] = []
+        self._pending_all: List[str] = []
+        self._flush_handle = None
         
     async def connect_redis(self):
         """Connect to Redis and subscribe to channels"""
@@ -27,181 +91,237 @@ class WebSocketServer:
             host=self.config['redis']['host'],
             port=self.config['redis']['port'],
             password=self.config['redis'].get('password', None),
-            decode_responses=True
+            # Keep payloads as raw bytes; orjson parses them without an
+            # intermediate UTF-8 decode to str
+            decode_responses=False,
+            # Larger reads let one recv pull in a burst of pub/sub frames
+            socket_read_size=65536
         )
         
-        self.pubsub = self.redis_client.pubsub()
+        # Channels whose publishers are trusted to send valid JSON; their
+        # timestamped payloads are forwarded without being parsed
+        passthrough_channels = set(self.config['server'].get('passthroughChannels', []))
         
-        # Subscribe to all channels
-        await self.pubsub.subscribe(
-            self.config['channels']['marketData'],
-            self.config['channels']['orderUpdate'],
-            self.config['channels']['trade'],
-            self.config['channels']['error']
-        )
+        # One pub/sub connection per channel so a burst on one channel can't
+        # hold up delivery on the others. Each is paired with the client set
+        # and pending batch it feeds; errors only go to all-channel clients
+        for channel, clients, pending in (
+            (self.config['channels']['marketData'], self.market_data_clients, self._pending_market),
+            (self.config['channels']['orderUpdate'], self.order_update_clients, self._pending_order),
+            (self.config['channels']['trade'], self.trade_clients, self._pending_trade),
+            (self.config['channels']['error'], None, None),
+        ):
+            pubsub = self.redis_client.pubsub()
+            await pubsub.subscribe(channel)
+            self.pubsubs.append((pubsub, clients, pending, channel in passthrough_channels))
         
         logger.info("Connected to Redis and subscribed to channels")
     
-    async def redis_listener(self):
-        """Listen to Redis pub/sub and broadcast to WebSocket clients"""
+    async def _listen_channel(self, pubsub, clients, pending, passthrough):
+        """Listen to a single Redis pub/sub channel and broadcast to WebSocket clients"""
+        loop = asyncio.get_running_loop()
         try:
-            async for message in self.pubsub.listen():
-                if message['type'] == 'message':
-                    channel = message['channel']
-                    data = message['data']
+            while True:
+                # Poll the connection directly rather than through listen()'s
+                # async generator; returns None when the timeout elapses idle
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None or message['type'] != 'message':
+                    continue
+                
+                data = message['data']
+                
+                try:
+                    if passthrough and b'"timestamp":' in data and data[:1] == b'{' and data[-1:] == b'}':
+                        # Already timestamped by a trusted publisher: nothing to
+                        # add, so forward its JSON as-is without a parse/encode
+                        # round-trip. The bytes are not validated, which is why
+                        # this is limited to trusted channels; anything else is
+                        # parsed so malformed input never reaches a batch frame
+                        payload = data.decode()
+                    else:
+                        # Parse the message and serialize it once; the same
+                        # payload goes to every client set
+                        parsed = orjson.loads(data)
+                        if not isinstance(parsed, dict):
+                            logger.warning(f"Dropping non-object message: {data[:100]!r}")
+                            continue
+                        payload = self._encode(parsed)
+                    
+                    if clients:
+                        pending.append(payload)
+                    
+                    # Always send to clients subscribed to all channels
+                    if self.all_clients:
+                        self._pending_all.append(payload)
+                    
+                    # Coalesce messages arriving within the batch window into
+                    # a single frame per client
+                    if self._flush_handle is None:
+                        self._flush_handle = loop.call_later(self._batch_window, self._flush)
+                    
+                except Exception as e:
+                    # A bad payload (invalid JSON or UTF-8) is dropped without
+                    # stopping this channel's listener
+                    logger.error(f"Error parsing message: {e}")
                     
-                    try:
-                        # Parse the message
-                        msg_data = json.loads(data) if isinstance(data, str) else data
-                        
-                        # Determine which clients to send to
-                        if channel == self.config['channels']['marketData']:
-                            await self.broadcast(self.market_data_clients, msg_data)
-                        elif channel == self.config['channels']['orderUpdate']:
-                            await self.broadcast(self.order_update_clients, msg_data)
-                        elif channel == self.config['channels']['trade']:
-                            await self.broadcast(self.trade_clients, msg_data)
-                        
-                        # Always send to clients subscribed to all channels
-                        await self.broadcast(self.all_clients, msg_data)
-                        
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Error parsing message: {e}")
-                        
         except Exception as e:
             logger.error(f"Error in Redis listener: {e}")
     
-    async def broadcast(self, clients: Set, message: dict):
-        """Broadcast message to all connected clients in the set"""
-        if not clients:
-            return
+    def _encode(self, message: dict) -> str:
+        """Serialize a message for broadcasting, adding a timestamp if missing"""
+        body = orjson.dumps(message)
         
-        # Add timestamp if not present
+        # Splice the timestamp into the encoded object rather than mutating
+        # the message and serializing it again
         if 'timestamp' not in message:
-            message['timestamp'] = int(datetime.utcnow().timestamp() * 1000)
+            separator = b',' if message else b''
+            body = body[:-1] + separator + b'"timestamp":%d}' % _now_ms()
         
-        message_str = json.dumps(message)
+        # orjson returns bytes; decode so clients keep receiving text frames
+        return body.decode()
+    
+    def _flush(self):
+        """Broadcast every pending message, one frame per client set"""
+        self._flush_handle = None
+        for clients, pending in (
+            (self.market_data_clients, self._pending_market),
+            (self.order_update_clients, self._pending_order),
+            (self.trade_clients, self._pending_trade),
+            (self.all_clients, self._pending_all),
+        ):
+            if not pending:
+                continue
+            
+            # A lone message goes out unwrapped; several are joined into a batch
+            # frame by splicing the already-encoded payloads
+            if len(pending) == 1:
+                payload = pending[0]
+            else:
+                payload = '{"type":"batch","messages":[' + ','.join(pending) + ']}'
+            pending.clear()
+            self._broadcast_encoded(clients, payload)
+    
+    def _broadcast_encoded(self, clients: WeakSet, payload: str):
+        """Broadcast an already-serialized message to all connected clients in the set"""
+        if not clients:
+            return
         
-        # Send to all clients, remove disconnected ones
+        # A client that isn't draining its socket is too slow; drop it rather
+        # than let its backlog grow without bound
         disconnected = set()
         for client in clients:
-            try:
-                await client.send(message_str)
-            except websockets.exceptions.ConnectionClosed:
-                disconnected.add(client)
-            except Exception as e:
-                logger.error(f"Error sending to client: {e}")
+            if client.transport.get_write_buffer_size() > CLIENT_WRITE_BUFFER_LIMIT:
+                logger.warning(f"Dropping slow client: {client.remote_address}")
                 disconnected.add(client)
+                close_task = asyncio.create_task(client.close(code=1008, reason='Client too slow'))
+                self._closing_tasks.add(close_task)
+                close_task.add_done_callback(self._closing_tasks.discard)
         
         # Remove disconnected clients
         clients.difference_update(disconnected)
+        
+        # Build the frame once and write it to every connection without awaiting;
+        # connections that are already closing are skipped
+        ws_broadcast(clients, payload)
+    
+    def _tune_socket(self, websocket):
+        """Configure a client's TCP socket for small, latency-sensitive frames"""
+        sock = websocket.transport.get_extra_info('socket')
+        if sock is None:
+            return
+        
+        # Disable Nagle so each frame is sent immediately instead of waiting on ACKs
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        # Larger send buffer lets the kernel absorb market data bursts before
+        # writes start backing up in the transport
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SNDBUF)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CLIENT_RCVBUF)
+    
+    def _subscription_ack(self, status: str, channel) -> str:
+        """Encode a subscription ack, using the prebuilt template for known channels"""
+        template = self._sub_templates[status].get(channel) if isinstance(channel, str) else None
+        if template is not None:
+            return template % _now_ms()
+        
+        # Unknown channels are echoed back as sent, so encode them properly
+        response = {
+            'type': 'subscription',
+            'status': status,
+            'channel': channel,
+            'timestamp': _now_ms()
+        }
+        return orjson.dumps(response).decode()
     
     async def handle_client(self, websocket, path):
         """Handle individual WebSocket client connections"""
         client_id = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
         logger.info(f"Client connected: {client_id} on path {path}")
         
-        # Register client based on path
-        if path == '/ws/marketdata':
-            self.market_data_clients.add(websocket)
-            logger.info(f"Client subscribed to market data: {client_id}")
-        elif path == '/ws/orderupdates':
-            self.order_update_clients.add(websocket)
-            logger.info(f"Client subscribed to order updates: {client_id}")
-        elif path == '/ws/trades':
-            self.trade_clients.add(websocket)
-            logger.info(f"Client subscribed to trades: {client_id}")
-        elif path == '/ws/all':
-            self.all_clients.add(websocket)
-            logger.info(f"Client subscribed to all channels: {client_id}")
-        else:
-            # Default to all channels
-            self.all_clients.add(websocket)
-            logger.info(f"Client subscribed to all channels (default): {client_id}")
+        self._tune_socket(websocket)
+        
+        # Register client based on path, defaulting to all channels
+        target, description = self._path_sets.get(path, (self.all_clients, 'all channels (default)'))
+        target.add(websocket)
+        logger.info(f"Client subscribed to {description}: {client_id}")
         
         # Send welcome message
         welcome_msg = {
             'type': 'connection',
             'status': 'connected',
             'message': f'Connected to WebSocket server on {path}',
-            'timestamp': int(datetime.utcnow().timestamp() * 1000)
+            'timestamp': _now_ms()
         }
-        await websocket.send(json.dumps(welcome_msg))
+        await websocket.send(orjson.dumps(welcome_msg).decode())
         
         try:
             # Keep connection alive and handle incoming messages
             async for message in websocket:
                 try:
-                    data = json.loads(message)
+                    data = orjson.loads(message)
+                    action = data.get('action')
                     
                     # Handle subscription changes
-                    if data.get('action') == 'subscribe':
+                    if action == 'subscribe':
                         channel = data.get('channel')
-                        if channel == 'marketdata':
-                            self.market_data_clients.add(websocket)
-                        elif channel == 'orderupdates':
-                            self.order_update_clients.add(websocket)
-                        elif channel == 'trades':
-                            self.trade_clients.add(websocket)
+                        clients = self._channel_sets.get(channel) if isinstance(channel, str) else None
+                        if clients is not None:
+                            clients.add(websocket)
                         
-                        response = {
-                            'type': 'subscription',
-                            'status': 'success',
-                            'channel': channel,
-                            'timestamp': int(datetime.utcnow().timestamp() * 1000)
-                        }
-                        await websocket.send(json.dumps(response))
+                        await websocket.send(self._subscription_ack('success', channel))
                     
-                    elif data.get('action') == 'unsubscribe':
+                    elif action == 'unsubscribe':
                         channel = data.get('channel')
-                        if channel == 'marketdata':
-                            self.market_data_clients.discard(websocket)
-                        elif channel == 'orderupdates':
-                            self.order_update_clients.discard(websocket)
-                        elif channel == 'trades':
-                            self.trade_clients.discard(websocket)
+                        clients = self._channel_sets.get(channel) if isinstance(channel, str) else None
+                        if clients is not None:
+                            clients.discard(websocket)
                         
-                        response = {
-                            'type': 'subscription',
-                            'status': 'unsubscribed',
-                            'channel': channel,
-                            'timestamp': int(datetime.utcnow().timestamp() * 1000)
-                        }
-                        await websocket.send(json.dumps(response))
+                        await websocket.send(self._subscription_ack('unsubscribed', channel))
                     
-                    elif data.get('action') == 'ping':
-                        pong = {
-                            'type': 'pong',
-                            'timestamp': int(datetime.utcnow().timestamp() * 1000)
-                        }
-                        await websocket.send(json.dumps(pong))
+                    elif action == 'ping':
+                        await websocket.send(PONG_TEMPLATE % _now_ms())
                         
-                except json.JSONDecodeError:
-                    error_msg = {
-                        'type': 'error',
-                        'message': 'Invalid JSON',
-                        'timestamp': int(datetime.utcnow().timestamp() * 1000)
-                    }
-                    await websocket.send(json.dumps(error_msg))
+                except orjson.JSONDecodeError:
+                    await websocket.send(INVALID_JSON_TEMPLATE % _now_ms())
                     
         except websockets.exceptions.ConnectionClosed:
             logger.info(f"Client disconnected: {client_id}")
         except Exception as e:
             logger.error(f"Error handling client {client_id}: {e}")
         finally:
-            # Cleanup: remove client from all sets
-            self.market_data_clients.discard(websocket)
-            self.order_update_clients.discard(websocket)
-            self.trade_clients.discard(websocket)
-            self.all_clients.discard(websocket)
+            # The client sets hold weak references, so the connection leaves
+            # them once it is released; broadcasts skip it if it is closed
             logger.info(f"Client removed: {client_id}")
     
     async def start(self):
         """Start the WebSocket server"""
         await self.connect_redis()
         
-        # Start Redis listener task
-        redis_task = asyncio.create_task(self.redis_listener())
+        # Start one Redis listener task per channel
+        redis_tasks = [
+            asyncio.create_task(self._listen_channel(pubsub, clients, pending, passthrough))
+            for pubsub, clients, pending, passthrough in self.pubsubs
+        ]
         
         # Start WebSocket server
         host = self.config['server']['host']
@@ -209,7 +329,12 @@ class WebSocketServer:
         
         logger.info(f"Starting WebSocket server on {host}:{port}")
         
-        async with websockets.serve(self.handle_client, host, port):
+        # permessage-deflate compresses every frame separately for each
+        # connection, repeating the same zlib work across all recipients of a
+        # broadcast; it stays off unless explicitly enabled
+        compression = self.config['server'].get('compression')
+        
+        async with websockets.serve(self.handle_client, host, port, compression=compression):
             logger.info(f"WebSocket server running on ws://{host}:{port}")
             await asyncio.Future()  # Run forever
 
@@ -224,7 +349,10 @@ def load_config(config_file='config/websocket.json'):
         return {
             'server': {
                 'host': '0.0.0.0',
-                'port': 8765
+                'port': 8765,
+                'batchWindowMs': 2,
+                'compression': None,
+                'passthroughChannels': ['market_data']
             },
             'redis': {
                 'host': 'localhost',
@@ -257,6 +385,9 @@ async def main():
 
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\nShutting down WebSocket server...")